@@ -1,5 +1,6 @@
 import os
 import logging
+from functools import lru_cache
 from pathlib import Path
 from pydantic_settings import BaseSettings
 from dotenv import find_dotenv, load_dotenv
@@ -97,8 +98,13 @@ class Settings(BaseSettings):
         env_prefix = ""
         extra = "ignore"  # 追加のフィールドを許可する設定
 
+@lru_cache
+def get_settings() -> Settings:
+    """設定を一度だけ生成してキャッシュする"""
+    return Settings()
+
 # 設定のグローバルインスタンス
-settings = Settings()
+settings = get_settings()
 
 # 設定値のログ出力（デバッグ用）
 logger.info("設定を読み込みました:")
@@ -1,11 +1,13 @@
 from fastapi import FastAPI, HTTPException, Header, Body
+from fastapi.responses import ORJSONResponse
 from app.session_manager import init_session_manager, get_session_manager
 from app.config import settings
 from typing import Dict, Any, Optional
 from pydantic import BaseModel
 import logging
 
-app = FastAPI(title="MT5 Bridge API")
+# レスポンスのシリアライズは C 実装の orjson で行う
+app = FastAPI(title="MT5 Bridge API", default_response_class=ORJSONResponse)
 
 # セッションマネージャーの初期化
 init_session_manager()
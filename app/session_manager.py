@@ -5,7 +5,8 @@ import os
 import shutil
 import json
 import sys
-from typing import NamedTuple, Dict, Optional, Any, List, Tuple
+from typing import NamedTuple, Dict, Optional, Any, List, Tuple, Callable
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import logging
 import glob
@@ -18,8 +19,9 @@ import psutil
 from pathlib import Path
 import select
 import signal
-from app.config import settings
+from app.config import settings, logs_dir
 import hashlib
+from types import MappingProxyType
 
 # 安全なストリームラッパー
 def safe_wrap_stream(stream, encoding='utf-8'):
@@ -132,8 +134,8 @@ class Session(NamedTuple):
     created_at: datetime
     last_accessed: datetime
 
-# MT5 APIエラーコードとメッセージの対応
-MT5_ERROR_CODES = {
+# MT5 APIエラーコードとメッセージの対応（読み取り専用）
+MT5_ERROR_CODES = MappingProxyType({
     -10005: "IPC Timeout - プロセス間通信がタイムアウトしました。MT5との接続確立に失敗しました。",
     -10004: "IPC Initialization Error - プロセス間通信の初期化に失敗しました。",
     -10003: "IPC Test Socket Creation Error - テストソケットの作成に失敗しました。",
@@ -150,7 +152,7 @@ MT5_ERROR_CODES = {
     -2: "Communication with terminal not established - ターミナルとの通信が確立されていません。",
     -1: "Unknown Error - 原因不明のエラーです。",
     0: "No Error - 操作は正常に完了しました。",
-}
+})
 
 def get_detailed_error(error_code, error_message):
     """MT5エラーコードの詳細な説明を取得する"""
@@ -371,6 +373,9 @@ def check_gui_status(pid: int) -> Dict[str, Any]:
     
     return result
 
+# 自動アップデート無効化とログ設定用 common.ini の内容（全セッション共通）
+COMMON_INI_STRING = '[General]\nSkipUpdate=1\n\n[Logs]\nLevel=error\nMaxLogSizeMB=1\n'
+
 def create_session_directory(session_id: str) -> Tuple[str, str]:
     """セッション用データディレクトリを作成し、Config と accounts.dat のみコピーし、
     MetaTrader5 実行ファイルのパスとセッションディレクトリを返す"""
@@ -386,7 +391,7 @@ def create_session_directory(session_id: str) -> Tuple[str, str]:
     os.makedirs(cfg_dir, exist_ok=True)
     common_ini = os.path.join(cfg_dir, 'common.ini')
     with open(common_ini, 'w', encoding='utf-8') as f:
-        f.write('[General]\nSkipUpdate=1\n\n[Logs]\nLevel=error\nMaxLogSizeMB=1\n')
+        f.write(COMMON_INI_STRING)
     # チャートを空にして読み込まないように
     charts_dir = os.path.join(session_dir, 'profiles', 'charts', 'Default')
     if os.path.isdir(charts_dir):
@@ -411,6 +416,24 @@ def create_session_directory(session_id: str) -> Tuple[str, str]:
     exe_path = os.path.join(session_dir, 'terminal64.exe')
     return exe_path, session_dir
 
+# worker の candles 応答の列（worker.py の CANDLE_FIELDS と同じ順）
+CANDLE_FIELDS = ('time', 'open', 'high', 'low', 'close', 'tick_volume')
+
+def candle_rows(columns: Any) -> List[Dict[str, Any]]:
+    """worker の列形式の candles 結果をバーごとの dict のリストに戻す
+
+    worker は IPC を小さくするため {"time": [...], "open": [...], ...} で返すが、
+    API の利用者には従来どおり [{"time": ..., "open": ..., ...}, ...] を返す。
+    """
+    if not columns:
+        return []
+    if isinstance(columns, list):
+        return columns
+    return [
+        dict(zip(CANDLE_FIELDS, row))
+        for row in zip(*(columns.get(k, []) for k in CANDLE_FIELDS))
+    ]
+
 # WorkerSession: 完全独立プロセスで動作する MT5 セッションラッパー
 class WorkerSession:
     """サブプロセスで MT5 を初期化・コマンド処理するセッション"""
@@ -422,11 +445,20 @@ class WorkerSession:
         self.last_access = self.created_at
         self.proc = proc
         self.mt5_pid: Optional[int] = None  # 初期化時に設定
+        self.stderr_log: Optional[io.BufferedWriter] = None  # ワーカーの stderr 出力先
+        self.stderr_path: Optional[str] = None  # stderr ログのパス
+        self.on_access: Optional[Callable[[str], None]] = None  # アクセス時に SessionManager へ通知する
+
+    def touch(self) -> None:
+        """最終アクセス時間を更新する"""
+        self.last_access = datetime.now()
+        if self.on_access:
+            self.on_access(self.session_id)
 
     def send_command(self, command: dict) -> Any:
         """子プロセスに JSON コマンドを送信し、結果を返す"""
         # 最終アクセス時間更新
-        self.last_access = datetime.now()
+        self.touch()
         # JSON 送信
         self.proc.stdin.write(json.dumps(command) + "\n")
         try:
@@ -439,6 +471,11 @@ class WorkerSession:
         res = json.loads(line)
         if not res.get("success"):
             raise Exception(res.get("error"))
+        # 列形式の candles は行形式に戻す（binary 指定時は要求どおり列のまま返す）
+        if command.get("type") == "candles":
+            result = res.get("result")
+            if not (isinstance(result, dict) and result.get("binary")):
+                res["result"] = candle_rows(result)
         return res
 
     def cleanup(self):
@@ -461,14 +498,39 @@ class WorkerSession:
                 pass
         except Exception:
             pass
+        # セッションディレクトリ削除前に stderr ログを閉じる
+        if self.stderr_log:
+            try:
+                self.stderr_log.close()
+            except Exception:
+                pass
+        # ログは失敗したワーカーの分だけ残す（空のログと正常終了したワーカーのログは削除する）
+        if self.stderr_path:
+            try:
+                if self.proc.returncode == 0 or os.path.getsize(self.stderr_path) == 0:
+                    os.remove(self.stderr_path)
+            except OSError:
+                pass
 
 class SessionManager:
     def __init__(self):
-        self.sessions: Dict[str, WorkerSession] = {}
+        # 最終アクセス順（古い順）に並べる。期限切れの判定は先頭から行う
+        self.sessions: "OrderedDict[str, WorkerSession]" = OrderedDict()
+
+    def _on_session_access(self, session_id: str) -> None:
+        """アクセスされたセッションを末尾（最新）へ移動する"""
+        try:
+            self.sessions.move_to_end(session_id)
+        except KeyError:
+            # クリーンアップ済みのセッション
+            pass
 
     def get_session(self, session_id: str) -> Optional[WorkerSession]:
-        """セッションを取得する"""
-        return self.sessions.get(session_id)
+        """セッションを取得する（最終アクセス時間も更新する）"""
+        session = self.sessions.get(session_id)
+        if session:
+            session.touch()
+        return session
 
     def create_session(self, login: int, password: str, server: str) -> str:
         """新しいセッションを作成する"""
@@ -491,15 +553,40 @@ class SessionManager:
             "--exe-path", exe_path,
             "--data-dir", data_dir
         ]
-        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        # stdout は IPC に使うため PIPE のまま。stderr はセッションごとのログファイルへ書き出す
+        # (セッションディレクトリと一緒に削除されないよう、ログディレクトリに置く。
+        #  起動に失敗した場合は調査用に残し、終了時の扱いは WorkerSession.cleanup で決める)
+        os.makedirs(logs_dir, exist_ok=True)
+        stderr_path = os.path.join(logs_dir, f'worker_{session_id}.log')
+        stderr_log = open(stderr_path, 'ab')
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr_log, text=True, encoding='utf-8')
+        except Exception:
+            stderr_log.close()
+            raise
         # 初期化メッセージから MT5 terminal64.exe の PID を取得
-        init_line = proc.stdout.readline()
-        init_data = json.loads(init_line)
-        if not init_data.get("success"):
-            raise Exception(f"MT5 初期化失敗: {init_data.get('error')}")
+        try:
+            init_line = proc.stdout.readline()
+            if not init_line:
+                raise Exception(f"worker が初期化前に終了しました (詳細: {stderr_path})")
+            init_data = json.loads(init_line)
+            if not init_data.get("success"):
+                raise Exception(f"MT5 初期化失敗: {init_data.get('error')}")
+        except Exception:
+            # 失敗時は worker を終了・回収してからログを閉じる
+            try:
+                proc.kill()
+                proc.wait(timeout=5)
+            except Exception:
+                pass
+            stderr_log.close()
+            raise
         mt5_pid = init_data.get("mt5_pid")
         session = WorkerSession(session_id, login, server, proc)
+        session.stderr_log = stderr_log
+        session.stderr_path = stderr_path
         session.mt5_pid = mt5_pid
+        session.on_access = self._on_session_access
         self.sessions[session_id] = session
         return session_id
 
@@ -508,12 +595,18 @@ class SessionManager:
         session = self.sessions.pop(session_id, None)
         if session:
             session.cleanup()
-            # MT5 terminal64.exe プロセスを PID で強制終了
+            # MT5 terminal64.exe プロセス（とその子プロセス）を PID で強制終了
+            # 他セッションの terminal64.exe には影響しない
             if session.mt5_pid:
                 try:
                     proc = psutil.Process(session.mt5_pid)
-                    proc.kill()
-                    proc.wait(timeout=5)
+                    procs = proc.children(recursive=True) + [proc]
+                    for p in procs:
+                        try:
+                            p.kill()
+                        except psutil.NoSuchProcess:
+                            pass
+                    psutil.wait_procs(procs, timeout=2)
                 except Exception:
                     pass
             # セッションディレクトリを削除
@@ -531,12 +624,14 @@ class SessionManager:
             List[str]: クリーンアップされたセッションIDのリスト
         """
         now = datetime.now()
-        old_sessions = [
-            session_id for session_id, session in self.sessions.items()
-            if (now - session.last_access).total_seconds() > max_age_seconds
-        ]
-        for session_id in old_sessions:
+        old_sessions = []
+        # sessions は最終アクセス順なので、先頭から期限切れでないものが現れるまで取り出す
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if (now - session.last_access).total_seconds() <= max_age_seconds:
+                break
             self.cleanup_session(session_id)
+            old_sessions.append(session_id)
         return old_sessions
 
     def list_sessions(self) -> Dict[str, Dict[str, Any]]:
@@ -551,7 +646,7 @@ class SessionManager:
                 "last_accessed": session.last_access.isoformat(),
                 "age_seconds": (now - session.last_access).total_seconds()
             }
-            for session_id, session in self.sessions.items()
+            for session_id, session in list(self.sessions.items())
         }
 
     def execute_command(self, session_id: str, command: str, params: Dict[str, Any]) -> Any:
@@ -560,7 +655,6 @@ class SessionManager:
         if not session:
             raise Exception(f"セッション {session_id} が見つかりません")
             
-        session.last_access = datetime.now()
         return session.send_command({
             "type": command,
             "params": params
@@ -1,8 +1,12 @@
+import asyncio
 import pytest
+import pytest_asyncio
+import httpx
 from fastapi.testclient import TestClient
 from app.main import app
 from app.config import settings
-from app.session_manager import init_session_manager, get_session_manager
+from app.session_manager import init_session_manager, get_session_manager, WorkerSession
+from tests.helpers import FakeWorkerProc
 import os
 import logging
 
@@ -10,25 +14,101 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# オープンファイル数のソフト上限を引き上げる（負荷テストのソケット・パイプ・ログ用）
+# Windows には resource モジュールがないため何もしない
+try:
+    import resource
+    _soft, _hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    _target = 65536 if _hard == resource.RLIM_INFINITY else min(_hard, 65536)
+    if _soft != resource.RLIM_INFINITY and _soft < _target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (_target, _hard))
+except (ImportError, ValueError, OSError) as e:
+    logger.warning(f"RLIMIT_NOFILE を引き上げられませんでした: {e}")
+
+# POSIX では uvloop が使えればテスト全体のイベントループに使う
+# (Windows では uvloop が提供されないため既定のループのまま)
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 # テスト用の設定
 TEST_BRIDGE_TOKEN = "test_token"
 TEST_MT5_PATH = os.getenv("TEST_MT5_PATH", "path/to/test/mt5")
 
-@pytest.fixture
+# pytest-xdist のワーカーごとにセッションディレクトリを分けて衝突を避ける
+WORKER_ID = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+
+def pytest_collection_modifyitems(config, items):
+    """
+    pytest-xdist で並列実行している場合は負荷テストを除外する
+    (他のワーカーと同時に走ると応答時間の計測が歪むため、単独で実行すること)
+    """
+    if "PYTEST_XDIST_WORKER" not in os.environ:
+        return
+    deselected = [item for item in items if item.get_closest_marker("load")]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = [item for item in items if not item.get_closest_marker("load")]
+
+@pytest.fixture(scope="session", autouse=True)
+def _override_settings():
+    """
+    テスト用の設定を一度だけ適用し、終了時に元に戻す
+    """
+    old_token = settings.bridge_token
+    old_base_path = settings.sessions_base_path
+    settings.bridge_token = TEST_BRIDGE_TOKEN
+    # セッションディレクトリもワーカー単位に分離する
+    settings.sessions_base_path = os.path.join(old_base_path, WORKER_ID)
+    yield
+    settings.bridge_token = old_token
+    settings.sessions_base_path = old_base_path
+
+@pytest.fixture(scope="session")
 def test_app():
     """
     テスト用のFastAPIアプリケーションを提供
     """
-    # テスト用の設定を適用
-    settings.bridge_token = TEST_BRIDGE_TOKEN
     return app
 
-@pytest.fixture
-def client(test_app):
+@pytest.fixture(scope="session")
+def client(test_app, session_manager):
     """
-    テスト用のHTTPクライアント
+    テスト用のHTTPクライアント（テストセッション全体で共有）
+    with ブロックで startup/shutdown イベントを一度だけ実行する
+    セッションマネージャーは必ずクライアント起動前に初期化される
     """
-    return TestClient(test_app)
+    with TestClient(test_app) as c:
+        yield c
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """
+    テストセッション全体で共有するイベントループ（セッションスコープの非同期フィクスチャ用）
+    """
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest_asyncio.fixture(scope="session")
+async def async_client(test_app):
+    """
+    テスト用の非同期HTTPクライアント（テストセッション全体で共有）
+    """
+    transport = httpx.ASGITransport(app=test_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as c:
+        yield c
+
+@pytest.fixture(params=["sync", "async"])
+def api_client(request):
+    """
+    同期（TestClient）と非同期（httpx.AsyncClient）の両方でテストするためのクライアント
+    """
+    if request.param == "sync":
+        return request.getfixturevalue("client")
+    return request.getfixturevalue("async_client")
 
 @pytest.fixture
 def auth_headers():
@@ -38,25 +118,93 @@ def auth_headers():
     return {"x-api-token": TEST_BRIDGE_TOKEN}
 
 @pytest.fixture
-def session_manager():
+def json_headers(auth_headers):
+    """
+    シリアライズ済みのボディを content= で送るための認証ヘッダー
+    """
+    return {**auth_headers, "content-type": "application/json"}
+
+@pytest.fixture(scope="session")
+def test_config():
     """
-    テスト用のセッションマネージャー
+    テスト用のMT5ログイン情報
+    """
+    return {
+        "login": int(os.getenv("MT5_LOGIN", "12345")),
+        "password": os.getenv("MT5_PASSWORD", "test_password"),
+        "server": os.getenv("MT5_SERVER", "test_server"),
+    }
+
+@pytest.fixture
+def fake_session():
+    """
+    決まった応答行を返す偽の worker につながった WorkerSession を作るファクトリ（MT5 不要）
+    """
+    def _make(*responses, returncode=0):
+        return WorkerSession("test", 12345, "test_server", FakeWorkerProc(*responses, returncode=returncode))
+    return _make
+
+@pytest.fixture(scope="session")
+def _warmed_manager(test_config):
+    """
+    セッションマネージャーと、事前に作成（ウォームアップ）した共有MT5セッションIDの組
+    MT5 の起動・ログインをフィクスチャのセットアップで一度だけ済ませ、
+    最初のテストがその時間を負担しないようにする。どちらもこのフィクスチャが所有する
     """
     init_session_manager(base_path="./test_data", portable_mt5_path=TEST_MT5_PATH)
     manager = get_session_manager()
-    yield manager
-    # テスト後のクリーンアップ
+    session_id = manager.create_session(**test_config)
+    yield manager, session_id
+    # テストセッション終了後のクリーンアップ（共有セッションも含む）
     manager.cleanup()
 
+@pytest.fixture(scope="session")
+def session_manager(_warmed_manager):
+    """
+    テスト用のセッションマネージャー（テストセッション全体で共有）
+    """
+    return _warmed_manager[0]
+
+@pytest.fixture
+def isolated_manager(session_manager):
+    """
+    テスト中に作成されたセッションだけを後片付けするセッションマネージャー
+    共有セッションはテスト間で維持される
+    """
+    snapshot = set(session_manager.sessions)
+    yield session_manager
+    for session_id in set(session_manager.sessions) - snapshot:
+        session_manager.cleanup_session(session_id)
+
+@pytest.fixture(scope="session")
+def shared_session(_warmed_manager):
+    """
+    テストセッション全体で共有するウォームアップ済みのMT5セッション（読み取り専用の用途向け）
+    """
+    return _warmed_manager[1]
+
+@pytest.fixture(scope="session")
+def symbols_result(session_manager, shared_session):
+    """
+    symbols_get の結果（テストセッション内では不変なので一度だけ取得）
+    """
+    return session_manager.execute_command(shared_session, "symbols_get", {})
+
+@pytest.fixture
+def test_session(shared_session):
+    """
+    テスト用のMT5セッション（読み取り専用のテスト向けに共有セッションを使う）
+    同じアカウントで別の terminal を起動しないよう、新たには作成しない
+    """
+    return shared_session
+
 @pytest.fixture
-def test_session(session_manager):
+def fresh_session(session_manager, test_config):
     """
-    テスト用のMT5セッション
+    セッションを変更・削除するテスト用の使い捨てMT5セッション
     """
-    session_id = session_manager.create_session()
+    session_id = session_manager.create_session(**test_config)
     yield session_id
-    # テスト後のクリーンアップ
+    # テスト後のクリーンアップ（削除済みなら何もしない）
     if session_id:
-        session = session_manager.get_session(session_id)
-        if session:
-            session.cleanup() 
\ No newline at end of file
+        session_manager.cleanup_session(session_id)
@@ -0,0 +1,48 @@
+"""
+テスト用の補助関数
+"""
+import inspect
+import io
+
+import orjson
+
+# worker の candles 応答（列形式）のサンプル: 2本分のバー
+CANDLE_COLUMNS = {
+    "time": [1672567200, 1672567500],
+    "open": [1.1032, 1.1033],
+    "high": [1.1035, 1.1036],
+    "low": [1.1031, 1.1032],
+    "close": [1.1033, 1.1034],
+    "tick_volume": [1250, 1300],
+}
+
+async def await_if_coro(value):
+    """同期クライアントの戻り値はそのまま、非同期クライアントの戻り値は await して返す"""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def create_session(client, headers, body):
+    """セッションを作成してセッションIDを返す（他のテストの前準備用）
+
+    body はシリアライズ済みの JSON バイト列、headers は content-type を含むこと
+    """
+    response = await await_if_coro(client.post("/v5/session/create", content=body, headers=headers))
+    assert response.status_code == 200
+    return orjson.loads(response.content)["session_id"]
+
+
+class FakeWorkerProc:
+    """worker.py の代わりに決まった応答行を返す Popen 相当のオブジェクト（WorkerSession の単体テスト用）"""
+
+    def __init__(self, *responses, returncode=0):
+        self.stdin = io.StringIO()
+        self.stdout = io.StringIO("".join(orjson.dumps(r).decode() + "\n" for r in responses))
+        self.returncode = None
+        self._exit_code = returncode
+
+    def wait(self, timeout=None):
+        """terminate を受け取った worker の終了を模す"""
+        self.returncode = self._exit_code
+        return self.returncode
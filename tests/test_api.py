@@ -1,7 +1,6 @@
-from fastapi.testclient import TestClient
 import pytest
-from app.models import OrderCreate
 
+@pytest.mark.xdist_group("sessions")
 def test_create_session(client, auth_headers):
     """セッション作成APIのテスト"""
     response = client.post("/v5/session/create", headers=auth_headers)
@@ -19,10 +18,11 @@ def test_session_command(client, auth_headers, test_session):
     assert response.status_code == 200
     assert response.json()["success"] is True
 
-def test_delete_session(client, auth_headers, test_session):
+@pytest.mark.xdist_group("sessions")
+def test_delete_session(client, auth_headers, fresh_session):
     """セッション削除APIのテスト"""
     response = client.delete(
-        f"/v5/session/{test_session}",
+        f"/v5/session/{fresh_session}",
         headers=auth_headers
     )
     assert response.status_code == 200
@@ -1,3 +1,4 @@
+import os
 import pytest
 import asyncio
 import websockets
@@ -5,17 +6,41 @@ import json
 import time
 from concurrent.futures import ThreadPoolExecutor
 from app.config import settings
-import requests
-import statistics
+import httpx
+import array
+import numpy as np
+
+# 1ユーザーあたりのファイルディスクリプタ見積もり
+# (WebSocket/HTTP ソケット + ワーカーの stdin/stdout + ログ等)
+FDS_PER_USER = 8
+FD_RESERVE = 64  # pytest やサーバー側が使う分
+
+def max_concurrent_users() -> int:
+    """RLIMIT_NOFILE のソフト上限から同時接続ユーザー数の上限を求める"""
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except ImportError:
+        return 10**6  # Windows: 制限なしとみなす
+    if soft == resource.RLIM_INFINITY:
+        return 10**6
+    return max(1, (soft - FD_RESERVE) // FDS_PER_USER)
 
 # 負荷テストの設定
 TEST_DURATION = 60  # テスト時間（秒）
-CONCURRENT_USERS = 10  # 同時接続ユーザー数
+# 同時接続ユーザー数（LOAD_TEST_USERS で変更可能、FD 上限で頭打ち）
+CONCURRENT_USERS = min(int(os.getenv("LOAD_TEST_USERS", "10")), max_concurrent_users())
 REQUEST_INTERVAL = 0.1  # リクエスト間隔（秒）
 
+# 送信内容は不変なので事前にシリアライズしておく
+INIT_FRAME = json.dumps({"type": "initialize"})
+PING_FRAME = json.dumps({"type": "ping"})
+PING_BYTES = PING_FRAME.encode("utf-8")
+JSON_HEADERS = {"content-type": "application/json"}
+
 class LoadTestMetrics:
     def __init__(self):
-        self.response_times = []
+        self.response_times = array.array('d')
         self.error_count = 0
         self.success_count = 0
         self.start_time = None
@@ -48,43 +73,51 @@ class LoadTestMetrics:
                 "total_duration": 0
             }
 
+        # array.array をコピーせずに numpy 配列として参照
+        arr = np.frombuffer(self.response_times, dtype=np.float64)
+        # 95パーセンタイルはソートせず partition (O(N)) で求める
+        k = min(int(0.95 * len(arr)), len(arr) - 1)
+
         return {
             "total_requests": self.success_count + self.error_count,
             "error_rate": self.error_count / (self.success_count + self.error_count),
-            "avg_response_time": statistics.mean(self.response_times),
-            "min_response_time": min(self.response_times),
-            "max_response_time": max(self.response_times),
-            "p95_response_time": statistics.quantiles(self.response_times, n=20)[18],
+            "avg_response_time": float(arr.mean()),
+            "min_response_time": float(arr.min()),
+            "max_response_time": float(arr.max()),
+            "p95_response_time": float(np.partition(arr, k)[k]),
             "total_duration": self.end_time - self.start_time
         }
 
-async def websocket_client(session_id: str, metrics: LoadTestMetrics):
-    """WebSocketクライアントの処理"""
-    uri = f"ws://localhost:8000/v5/ws/{session_id}?token={settings.bridge_token}"
+def websocket_uri(session_id: str) -> str:
+    """セッションの WebSocket URI"""
+    return f"ws://localhost:8000/v5/ws/{session_id}?token={settings.bridge_token}"
+
+async def websocket_client(websocket, metrics: LoadTestMetrics):
+    """WebSocketクライアントの処理（接続済みの WebSocket を駆動する）"""
     try:
-        async with websockets.connect(uri) as websocket:
-            start_time = time.time()
-            
-            # 初期化コマンドを送信
-            await websocket.send(json.dumps({"type": "initialize"}))
-            response = await websocket.recv()
+        test_start = time.time()
+        start_time = test_start
+        
+        # 初期化コマンドを送信
+        await websocket.send(INIT_FRAME)
+        response = await websocket.recv()
+        
+        end_time = time.time()
+        metrics.add_response_time(end_time - start_time)
+        metrics.add_success()
+        
+        # テスト期間中、定期的にコマンドを送信
+        while time.time() - test_start < TEST_DURATION:
+            await asyncio.sleep(REQUEST_INTERVAL)
             
+            start_time = time.time()
+            await websocket.send(PING_FRAME)
+            await websocket.recv()
             end_time = time.time()
+            
             metrics.add_response_time(end_time - start_time)
             metrics.add_success()
             
-            # テスト期間中、定期的にコマンドを送信
-            while time.time() - start_time < TEST_DURATION:
-                await asyncio.sleep(REQUEST_INTERVAL)
-                
-                start_time = time.time()
-                await websocket.send(json.dumps({"type": "ping"}))
-                await websocket.recv()
-                end_time = time.time()
-                
-                metrics.add_response_time(end_time - start_time)
-                metrics.add_success()
-                
     except Exception as e:
         metrics.add_error()
         print(f"WebSocket error: {e}")
@@ -94,89 +127,97 @@ def http_client(session_id: str, metrics: LoadTestMetrics):
     headers = {"x-api-token": settings.bridge_token}
     base_url = "http://localhost:8000/v5"
     
-    start_time = time.time()
-    while time.time() - start_time < TEST_DURATION:
-        try:
-            req_start = time.time()
-            response = requests.post(
-                f"{base_url}/session/{session_id}/command",
-                headers=headers,
-                json={"type": "ping"}
-            )
-            req_end = time.time()
-            
-            if response.status_code == 200:
-                metrics.add_success()
-            else:
+    # スレッドごとに1つのクライアントを使い、接続を使い回す（keep-alive）
+    with httpx.Client(base_url=base_url, headers=headers, timeout=2.0) as client:
+        start_time = time.time()
+        while time.time() - start_time < TEST_DURATION:
+            try:
+                req_start = time.time()
+                response = client.post(
+                    f"/session/{session_id}/command",
+                    content=PING_BYTES,
+                    headers=JSON_HEADERS
+                )
+                req_end = time.time()
+                
+                if response.status_code == 200:
+                    metrics.add_success()
+                else:
+                    metrics.add_error()
+                
+                metrics.add_response_time(req_end - req_start)
+                time.sleep(REQUEST_INTERVAL)
+                
+            except Exception as e:
                 metrics.add_error()
-            
-            metrics.add_response_time(req_end - req_start)
-            time.sleep(REQUEST_INTERVAL)
-            
-        except Exception as e:
-            metrics.add_error()
-            print(f"HTTP error: {e}")
+                print(f"HTTP error: {e}")
+
+def cleanup_sessions(session_manager, sessions):
+    """テストセッションを並行してクリーンアップ（MT5 プロセスとセッションディレクトリも削除する）"""
+    with ThreadPoolExecutor(max_workers=CONCURRENT_USERS) as executor:
+        list(executor.map(session_manager.cleanup_session, sessions))
 
 @pytest.mark.load
-def test_websocket_load(session_manager):
-    """WebSocket負荷テスト"""
+async def test_websocket_load(session_manager, test_config):
+    """WebSocket負荷テスト（テスト全体で共有するイベントループ上で実行する）"""
     metrics = LoadTestMetrics()
-    metrics.start()
-    
-    # テストセッションの作成
-    sessions = [session_manager.create_session() for _ in range(CONCURRENT_USERS)]
-    
-    # 非同期タスクの作成
-    loop = asyncio.get_event_loop()
-    tasks = [
-        websocket_client(session_id, metrics)
-        for session_id in sessions
-    ]
     
-    # テストの実行
-    loop.run_until_complete(asyncio.gather(*tasks))
+    # テストセッションを並行して作成
+    sessions = await asyncio.gather(
+        *(asyncio.to_thread(session_manager.create_session, **test_config) for _ in range(CONCURRENT_USERS))
+    )
     
-    metrics.stop()
-    summary = metrics.get_summary()
-    
-    # クリーンアップ
-    for session_id in sessions:
-        session = session_manager.get_session(session_id)
-        if session:
-            session.cleanup()
+    try:
+        # 計測前に全 WebSocket を並行して接続しておく（ハンドシェイクを計測に含めない）
+        conns = await asyncio.gather(
+            *(websockets.connect(websocket_uri(session_id)) for session_id in sessions)
+        )
+        try:
+            metrics.start()
+            async with asyncio.TaskGroup() as tg:
+                for conn in conns:
+                    tg.create_task(websocket_client(conn, metrics))
+        finally:
+            await asyncio.gather(*(conn.close() for conn in conns))
+        
+        metrics.stop()
+        summary = metrics.get_summary()
+    finally:
+        # クリーンアップ
+        await asyncio.to_thread(cleanup_sessions, session_manager, sessions)
     
     # 結果の検証
     assert summary["error_rate"] < 0.1  # エラー率10%未満
     assert summary["p95_response_time"] < 1.0  # 95パーセンタイルのレスポンス時間が1秒未満
 
 @pytest.mark.load
-def test_http_load(session_manager):
+def test_http_load(session_manager, test_config):
     """HTTP負荷テスト"""
     metrics = LoadTestMetrics()
-    metrics.start()
-    
-    # テストセッションの作成
-    sessions = [session_manager.create_session() for _ in range(CONCURRENT_USERS)]
     
-    # スレッドプールの作成
+    # テストセッションを並行して作成
     with ThreadPoolExecutor(max_workers=CONCURRENT_USERS) as executor:
-        futures = [
-            executor.submit(http_client, session_id, metrics)
-            for session_id in sessions
-        ]
-        
-        # すべてのタスクの完了を待機
-        for future in futures:
-            future.result()
-    
-    metrics.stop()
-    summary = metrics.get_summary()
+        sessions = list(executor.map(lambda _: session_manager.create_session(**test_config), range(CONCURRENT_USERS)))
     
-    # クリーンアップ
-    for session_id in sessions:
-        session = session_manager.get_session(session_id)
-        if session:
-            session.cleanup()
+    try:
+        metrics.start()
+        
+        # スレッドプールの作成
+        with ThreadPoolExecutor(max_workers=CONCURRENT_USERS) as executor:
+            futures = [
+                executor.submit(http_client, session_id, metrics)
+                for session_id in sessions
+            ]
+            
+            # すべてのタスクの完了を待機
+            for future in futures:
+                future.result()
+        
+        metrics.stop()
+        summary = metrics.get_summary()
+    finally:
+        # クリーンアップ
+        cleanup_sessions(session_manager, sessions)
     
     # 結果の検証
     assert summary["error_rate"] < 0.1  # エラー率10%未満
@@ -3,171 +3,139 @@
 MT5関連のテストモジュール
 - MT5の直接初期化テスト
 - セッション作成テスト
+各テストは同期・非同期の両クライアント（api_client）で実行される
 """
 import os
-import sys
-import time
-import json
+import asyncio
+import orjson
 import pytest
-from fastapi.testclient import TestClient
-from app.main import app
-from app.config import settings
-from app.session_manager import init_session_manager, get_session_manager
+from tests.helpers import await_if_coro, create_session
 
-class TestMT5:
-    @pytest.fixture(autouse=True)
-    def setup(self):
-        """テストの前準備"""
-        self.app = app
-        self.client = TestClient(self.app)
-        
-        # 環境変数から設定を読み取る
-        self.test_login = int(os.getenv("MT5_LOGIN", "12345"))
-        self.test_password = os.getenv("MT5_PASSWORD", "test_password")
-        self.test_server = os.getenv("MT5_SERVER", "test_server")
-        settings.bridge_token = os.getenv("BRIDGE_TOKEN", "test_token")
-        
-        self.headers = {"x-api-token": settings.bridge_token}
-        
-        # セッションマネージャーの初期化
-        init_session_manager()
-        self.manager = get_session_manager()
-        
-        yield
-        
-        # テスト後のクリーンアップ
-        self.manager.cleanup()
+# 環境変数から設定を読み取る
+TEST_LOGIN = int(os.getenv("MT5_LOGIN", "12345"))
+TEST_PASSWORD = os.getenv("MT5_PASSWORD", "test_password")
+TEST_SERVER = os.getenv("MT5_SERVER", "test_server")
+
+# リクエストボディはモジュール読み込み時に一度だけシリアライズし、content= でそのまま送る
+VALID_CREATE_BODY_BYTES = orjson.dumps({
+    "login": TEST_LOGIN,
+    "password": TEST_PASSWORD,
+    "server": TEST_SERVER
+})
+INVALID_CREATE_BODY_BYTES = orjson.dumps({
+    "login": "invalid",  # loginは整数である必要がある
+    "password": TEST_PASSWORD,
+    "server": TEST_SERVER
+})
+SYMBOLS_GET_BODY_BYTES = orjson.dumps({"command": "symbols_get", "params": {}})
+JSON_CONTENT_TYPE = {"content-type": "application/json"}
+
+
+@pytest.mark.parametrize("headers,body,expected", [
+    (JSON_CONTENT_TYPE, VALID_CREATE_BODY_BYTES, 401),  # 認証なし
+    ({**JSON_CONTENT_TYPE, "x-api-token": "invalid_token"}, VALID_CREATE_BODY_BYTES, 401),  # 無効なトークン
+    ("json_headers", INVALID_CREATE_BODY_BYTES, 422),  # バリデーションエラー
+], ids=["unauthorized", "invalid_token", "invalid_data"])
+async def test_create_session_rejects(api_client, session_manager, request, headers, body, expected):
+    """不正なリクエストでのセッション作成が拒否されることをテストする"""
+    if isinstance(headers, str):
+        headers = request.getfixturevalue(headers)
+    response = await await_if_coro(api_client.post(
+        "/v5/session/create",
+        content=body,
+        headers=headers
+    ))
+    assert response.status_code == expected
+
+@pytest.mark.xdist_group("sessions")
+async def test_create_session(api_client, json_headers, isolated_manager):
+    """セッション作成をテストする"""
+    response = await await_if_coro(api_client.post(
+        "/v5/session/create",
+        content=VALID_CREATE_BODY_BYTES,
+        headers=json_headers
+    ))
     
-    def test_unauthorized_access(self):
-        """認証なしのアクセスをテストする"""
-        response = self.client.post(
-            "/v5/session/create",
-            json={
-                "login": self.test_login,
-                "password": self.test_password,
-                "server": self.test_server
-            }
-        )
-        assert response.status_code == 401
+    assert response.status_code == 200
+    result = orjson.loads(response.content)
+    assert result["success"] is True
+    assert "session_id" in result
     
-    def test_invalid_token(self):
-        """無効なトークンでのアクセスをテストする"""
-        response = self.client.post(
-            "/v5/session/create",
-            json={
-                "login": self.test_login,
-                "password": self.test_password,
-                "server": self.test_server
-            },
-            headers={"x-api-token": "invalid_token"}
-        )
-        assert response.status_code == 401
+    # セッションが実際に作成されたことを確認
+    session = isolated_manager.get_session(result["session_id"])
+    assert session is not None
+    assert session.login == TEST_LOGIN
+    assert session.server == TEST_SERVER
+
+@pytest.mark.xdist_group("sessions")
+async def test_session_list(api_client, auth_headers, json_headers, isolated_manager):
+    """セッション一覧の取得をテストする"""
+    # まずセッションを作成
+    session_id = await create_session(api_client, json_headers, VALID_CREATE_BODY_BYTES)
     
-    def test_create_session_invalid_data(self):
-        """無効なデータでのセッション作成をテストする"""
-        response = self.client.post(
-            "/v5/session/create",
-            json={
-                "login": "invalid",  # loginは整数である必要がある
-                "password": self.test_password,
-                "server": self.test_server
-            },
-            headers=self.headers
-        )
-        assert response.status_code == 422  # バリデーションエラー
+    response = await await_if_coro(api_client.get(
+        "/v5/session/list",
+        headers=auth_headers
+    ))
     
-    def test_create_session(self):
-        """セッション作成をテストする"""
-        response = self.client.post(
-            "/v5/session/create",
-            json={
-                "login": self.test_login,
-                "password": self.test_password,
-                "server": self.test_server
-            },
-            headers=self.headers
+    assert response.status_code == 200
+    result = orjson.loads(response.content)
+    assert result["success"] is True
+    assert "sessions" in result
+    sessions = result["sessions"]
+    assert isinstance(sessions, dict)
+    assert session_id in sessions
+    assert sessions[session_id]["login"] == TEST_LOGIN
+    assert sessions[session_id]["server"] == TEST_SERVER
+
+async def test_session_not_found(api_client, json_headers, session_manager):
+    """存在しないセッションへのアクセスをテストする"""
+    response = await await_if_coro(api_client.post(
+        "/v5/session/nonexistent/command",
+        content=SYMBOLS_GET_BODY_BYTES,
+        headers=json_headers
+    ))
+    assert response.status_code == 404
+
+@pytest.mark.xdist_group("sessions")
+async def test_session_workflow(api_client, auth_headers, json_headers, session_manager):
+    """セッションの一連の操作をテストする"""
+    # セッション作成
+    session_id = await create_session(api_client, json_headers, VALID_CREATE_BODY_BYTES)
+    
+    try:
+        # セッション一覧の確認とコマンド実行は互いに独立しているので並行して送る
+        list_resp, cmd_resp = await asyncio.gather(
+            await_if_coro(api_client.get(
+                "/v5/session/list",
+                headers=auth_headers
+            )),
+            await_if_coro(api_client.post(
+                f"/v5/session/{session_id}/command",
+                content=SYMBOLS_GET_BODY_BYTES,
+                headers=json_headers
+            ))
         )
         
-        assert response.status_code == 200
-        result = response.json()
-        assert result["success"] is True
-        assert "session_id" in result
-        
-        # セッションが実際に作成されたことを確認
-        session = self.manager.get_session(result["session_id"])
-        assert session is not None
-        assert session.login == self.test_login
-        assert session.server == self.test_server
-        
-        return result["session_id"]
-    
-    def test_session_list(self):
-        """セッション一覧の取得をテストする"""
-        # まずセッションを作成
-        session_id = self.test_create_session()
+        assert list_resp.status_code == 200
+        assert session_id in orjson.loads(list_resp.content)["sessions"]
         
-        response = self.client.get(
-            "/v5/session/list",
-            headers=self.headers
-        )
+        assert cmd_resp.status_code == 200
+        result = orjson.loads(cmd_resp.content)
+        assert result["success"] is True
+        assert "result" in result
+        assert isinstance(result["result"], list)
         
+    finally:
+        # クリーンアップ
+        response = await await_if_coro(api_client.delete(
+            f"/v5/session/{session_id}",
+            headers=auth_headers
+        ))
         assert response.status_code == 200
-        result = response.json()
-        assert result["success"] is True
-        assert "sessions" in result
-        sessions = result["sessions"]
-        assert isinstance(sessions, dict)
-        assert session_id in sessions
-        assert sessions[session_id]["login"] == self.test_login
-        assert sessions[session_id]["server"] == self.test_server
-    
-    def test_session_not_found(self):
-        """存在しないセッションへのアクセスをテストする"""
-        response = self.client.post(
-            "/v5/session/nonexistent/command",
-            json={
-                "command": "symbols_get",
-                "params": {}
-            },
-            headers=self.headers
-        )
-        assert response.status_code == 404
-    
-    def test_session_workflow(self):
-        """セッションの一連の操作をテストする"""
-        # セッション作成
-        session_id = self.test_create_session()
         
-        try:
-            # セッション一覧の確認
-            self.test_session_list()
-            
-            # コマンド実行
-            response = self.client.post(
-                f"/v5/session/{session_id}/command",
-                json={
-                    "command": "symbols_get",
-                    "params": {}
-                },
-                headers=self.headers
-            )
-            
-            assert response.status_code == 200
-            result = response.json()
-            assert result["success"] is True
-            assert "result" in result
-            assert isinstance(result["result"], list)
-            
-        finally:
-            # クリーンアップ
-            response = self.client.delete(
-                f"/v5/session/{session_id}",
-                headers=self.headers
-            )
-            assert response.status_code == 200
-            
-            # セッションが実際に削除されたことを確認
-            assert self.manager.get_session(session_id) is None
+        # セッションが実際に削除されたことを確認
+        assert session_manager.get_session(session_id) is None
 
 if __name__ == '__main__':
-    pytest.main(["-v", __file__]) 
\ No newline at end of file
+    pytest.main(["-v", __file__])
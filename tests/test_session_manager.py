@@ -2,85 +2,98 @@
 """
 セッションマネージャーのテストモジュール
 """
-import os
-import sys
-import time
-import unittest
+import pytest
 from datetime import datetime, timedelta
-from app.session_manager import SessionManager, MT5Session
+from freezegun import freeze_time
+from app.session_manager import SessionManager, WorkerSession
+from tests.helpers import CANDLE_COLUMNS
 
-class TestSessionManager(unittest.TestCase):
-    def setUp(self):
-        """テストの前準備"""
-        from app.session_manager import init_session_manager
-        init_session_manager()  # セッションマネージャーを初期化
-        self.manager = SessionManager()
-        self.test_login = 12345
-        self.test_password = "test_password"
-        self.test_server = "test_server"
-    
-    def tearDown(self):
-        """テスト後のクリーンアップ"""
-        self.manager.cleanup()
-    
-    def test_session_manager_initialization(self):
-        """セッションマネージャーの初期化をテストする"""
-        self.assertIsNotNone(self.manager)
-        self.assertIsInstance(self.manager, SessionManager)
-    
-    def test_create_session(self):
-        """新しいセッションの作成をテストする"""
-        session_id = self.manager.create_session(
-            self.test_login, self.test_password, self.test_server
-        )
-        self.assertIsNotNone(session_id)
-        session = self.manager.get_session(session_id)
-        self.assertIsInstance(session, MT5Session)
-        self.assertEqual(session.login, self.test_login)
-        self.assertEqual(session.server, self.test_server)
-    
-    def test_get_session(self):
-        """セッションの取得をテストする"""
-        session_id = self.manager.create_session(
-            self.test_login, self.test_password, self.test_server
-        )
-        session = self.manager.get_session(session_id)
-        self.assertIsNotNone(session)
-        self.assertEqual(session.session_id, session_id)
-    
-    def test_list_sessions(self):
-        """セッション一覧の取得をテストする"""
-        session_id = self.manager.create_session(
-            self.test_login, self.test_password, self.test_server
-        )
-        sessions = self.manager.list_sessions()
-        self.assertIn(session_id, sessions)
-        session_info = sessions[session_id]
-        self.assertEqual(session_info["login"], self.test_login)
-        self.assertEqual(session_info["server"], self.test_server)
-    
-    def test_cleanup_old_sessions(self):
-        """古いセッションのクリーンアップをテストする"""
-        session_id = self.manager.create_session(
-            self.test_login, self.test_password, self.test_server
-        )
-        session = self.manager.get_session(session_id)
-        session.last_access = datetime.now() - timedelta(hours=2)
-        cleaned_sessions = self.manager.cleanup_old_sessions()
-        self.assertIn(session_id, cleaned_sessions)
-        self.assertIsNone(self.manager.get_session(session_id))
-    
-    def test_execute_command(self):
-        """セッションでのコマンド実行をテストする"""
-        session_id = self.manager.create_session(
-            self.test_login, self.test_password, self.test_server
-        )
-        result = self.manager.execute_command(session_id, "symbols_get", {})
-        self.assertIsNotNone(result)
-        self.assertIsInstance(result, list)
-        self.assertTrue(len(result) > 0)
-        self.assertIn("name", result[0])
-        self.assertIn("digits", result[0])
 
-if __name__ == '__main__':
-    unittest.main() 
\ No newline at end of file
+def test_session_manager_initialization(session_manager):
+    """セッションマネージャーの初期化をテストする"""
+    assert session_manager is not None
+    assert isinstance(session_manager, SessionManager)
+
+def test_create_session(session_manager, test_session, test_config):
+    """新しいセッションの作成をテストする"""
+    assert test_session is not None
+    session = session_manager.get_session(test_session)
+    assert isinstance(session, WorkerSession)
+    assert session.login == test_config["login"]
+    assert session.server == test_config["server"]
+
+def test_get_session(session_manager, test_session):
+    """セッションの取得をテストする"""
+    session = session_manager.get_session(test_session)
+    assert session is not None
+    assert session.session_id == test_session
+
+def test_list_sessions(session_manager, test_session, test_config):
+    """セッション一覧の取得をテストする"""
+    sessions = session_manager.list_sessions()
+    assert test_session in sessions
+    session_info = sessions[test_session]
+    assert session_info["login"] == test_config["login"]
+    assert session_info["server"] == test_config["server"]
+
+@pytest.mark.xdist_group("sessions")
+def test_cleanup_old_sessions(test_config):
+    """古いセッションのクリーンアップをテストする"""
+    # 共有セッションまで期限切れにしないよう、専用のマネージャーで実行する
+    manager = SessionManager()
+    # 2時間前の時刻でセッションを作成して期限切れにする
+    # (cleanup は子プロセスの終了をタイムアウト付きで待つため、実時間のまま実行する)
+    with freeze_time(datetime.now() - timedelta(hours=2)):
+        session_id = manager.create_session(**test_config)
+    try:
+        cleaned_sessions = manager.cleanup_old_sessions()
+        assert session_id in cleaned_sessions
+        assert manager.get_session(session_id) is None
+    finally:
+        manager.cleanup()
+
+def test_execute_command(symbols_result):
+    """セッションでのコマンド実行をテストする"""
+    result = symbols_result
+    assert result is not None
+    assert isinstance(result, list)
+    assert len(result) > 0
+    assert "name" in result[0]
+    assert "digits" in result[0]
+
+def test_send_command_candles_rows(fake_session):
+    """worker の列形式の candles がバーごとの dict のリストに戻されることをテストする"""
+    session = fake_session({"type": "candles", "success": True, "result": CANDLE_COLUMNS})
+    res = session.send_command({"type": "candles", "params": {"symbol": "EURUSD", "timeframe": "M5"}})
+    assert res["result"] == [
+        {"time": 1672567200, "open": 1.1032, "high": 1.1035, "low": 1.1031, "close": 1.1033, "tick_volume": 1250},
+        {"time": 1672567500, "open": 1.1033, "high": 1.1036, "low": 1.1032, "close": 1.1034, "tick_volume": 1300},
+    ]
+
+def test_send_command_candles_empty(fake_session):
+    """バーがない場合は空リストになることをテストする"""
+    empty = {k: [] for k in CANDLE_COLUMNS}
+    session = fake_session({"type": "candles", "success": True, "result": empty})
+    assert session.send_command({"type": "candles", "params": {}})["result"] == []
+
+def test_send_command_candles_binary_passthrough(fake_session):
+    """binary 指定時は列形式のまま返されることをテストする"""
+    binary = {"binary": True, "dtypes": {"time": "<i8"}, "columns": {"time": ""}}
+    session = fake_session({"type": "candles", "success": True, "result": binary})
+    assert session.send_command({"type": "candles", "params": {"binary": True}})["result"] == binary
+
+@pytest.mark.parametrize("content, returncode, kept", [
+    (b"", 0, False),
+    (b"", 1, False),
+    (b"warning\n", 0, False),
+    (b"Traceback ...\n", 1, True),
+])
+def test_cleanup_worker_log(fake_session, tmp_path, content, returncode, kept):
+    """終了時に空のログと正常終了したワーカーのログが削除されることをテストする"""
+    session = fake_session(returncode=returncode)
+    session.stderr_path = str(tmp_path / "worker_test.log")
+    session.stderr_log = open(session.stderr_path, "ab")
+    session.stderr_log.write(content)
+    session.cleanup()
+    assert session.stderr_log.closed
+    assert (tmp_path / "worker_test.log").exists() is kept
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+worker.py の IPC プロトコルのテストモジュール
+- MetaTrader5 をスタブに差し替えて worker を読み込む
+- serve() に io.BytesIO を渡し、応答のバイト列を検証する
+"""
+import base64
+import importlib
+import io
+import json
+import socket
+import sys
+import types
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from tests.helpers import CANDLE_COLUMNS
+
+Tick = namedtuple("Tick", "bid ask time")
+TradeRequest = namedtuple("TradeRequest", "action symbol volume")
+OrderSendResult = namedtuple("OrderSendResult", "retcode order request")
+TradePosition = namedtuple("TradePosition", "ticket symbol volume")
+
+STUB_ERROR = (1, "stub error")
+# copy_rates_* が返す構造化配列の dtype（MT5 と同じく応答に含めない列も持つ）
+RATES_DTYPE = [
+    ("time", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"),
+    ("tick_volume", "<u8"), ("spread", "<i4"), ("real_volume", "<u8"),
+]
+RATES = np.array(
+    [row + (0, 0) for row in zip(*(CANDLE_COLUMNS[name] for name, _ in RATES_DTYPE[:6]))],
+    dtype=RATES_DTYPE,
+)
+
+
+def _stub_mt5():
+    """テスト用の MetaTrader5 スタブ（"EMPTY"/"UNKNOWN" などのシンボルで失敗系を返す）"""
+    mt5 = types.ModuleType("MetaTrader5")
+    mt5.TIMEFRAME_M5 = 5
+    mt5.TIMEFRAME_H1 = 16385
+    mt5.initialize = lambda **kwargs: True
+    mt5.shutdown = lambda: None
+    mt5.last_error = lambda: STUB_ERROR
+
+    def copy_rates(symbol, tf, start, count):
+        return None if symbol == "EMPTY" else RATES
+    mt5.copy_rates_from = copy_rates
+    mt5.copy_rates_from_pos = copy_rates
+    mt5.symbol_info_tick = lambda symbol: None if symbol == "UNKNOWN" else Tick(1.1, 1.2, 1672567200)
+    mt5.order_send = lambda **params: OrderSendResult(10009, 42, TradeRequest(1, params.get("symbol"), 0.1))
+    mt5.positions_get = lambda **params: (TradePosition(1, "EURUSD", 0.1), TradePosition(2, "USDJPY", 0.2))
+    mt5.symbol_select = lambda symbol, enable: symbol != "UNKNOWN"
+    return mt5
+
+
+@pytest.fixture(scope="module")
+def worker():
+    """MetaTrader5 スタブで読み込んだ worker モジュール"""
+    saved = sys.modules.get("MetaTrader5")
+    sys.modules["MetaTrader5"] = _stub_mt5()
+    sys.modules.pop("worker", None)
+    module = importlib.import_module("worker")
+    module._build_timeframe_map()
+    yield module
+    sys.modules.pop("worker", None)
+    if saved is None:
+        sys.modules.pop("MetaTrader5", None)
+    else:
+        sys.modules["MetaTrader5"] = saved
+
+
+class ChunkedReader(io.BytesIO):
+    """read1 が size バイトずつしか返さない入力ストリーム"""
+
+    def __init__(self, data: bytes, size: int):
+        super().__init__(data)
+        self._size = size
+
+    def read1(self, n: int = -1) -> bytes:
+        return super().read1(self._size)
+
+
+class CountingWriter(io.BytesIO):
+    """flush の回数を数える出力ストリーム"""
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+def request(cmd_type, **params) -> bytes:
+    return json.dumps({"type": cmd_type, "params": params}).encode() + b"\n"
+
+
+def serve(worker, data: bytes, in_stream=None) -> bytes:
+    """リクエストのバイト列を serve() に流し、応答のバイト列を返す"""
+    out_stream = io.BytesIO()
+    worker.serve(in_stream or io.BytesIO(data), out_stream)
+    return out_stream.getvalue()
+
+
+def test_dispatch(worker):
+    """各コマンドが HANDLERS のハンドラに振り分けられることをテストする"""
+    out = serve(worker, request("quote", symbol="EURUSD") + request("symbol_select", symbol="EURUSD"))
+    quote, select = (json.loads(line) for line in out.splitlines())
+    assert quote == {"type": "quote", "success": True, "result": {"bid": 1.1, "ask": 1.2, "time": 1672567200}}
+    assert select == {"type": "symbol_select", "success": True, "result": None}
+
+def test_error_response(worker):
+    """ハンドラが失敗を返した場合のエラー応答をテストする"""
+    out = serve(worker, request("quote", symbol="UNKNOWN"))
+    assert out.endswith(b"}\n")
+    assert json.loads(out) == {"type": "quote", "success": False, "error": f"quoteに失敗: {STUB_ERROR}"}
+
+def test_handler_exception(worker):
+    """ハンドラ内の例外がエラー応答になることをテストする"""
+    out = serve(worker, request("candles", symbol="EURUSD", timeframe="XX"))
+    assert json.loads(out) == {"type": "candles", "success": False, "error": "不明なタイムフレーム: XX"}
+
+def test_unknown_command(worker):
+    """不明なコマンドのエラー応答をテストする"""
+    out = serve(worker, request("nope"))
+    assert json.loads(out) == {"type": "nope", "success": False, "error": "不明なコマンド: nope"}
+
+def test_candles_columns_bytes(worker):
+    """candles が列ごとの配列として書き出されることをテストする"""
+    out = serve(worker, request("candles", symbol="EURUSD", timeframe="m5", count=2))
+    assert out == (
+        b'{"type":"candles","success":true,"result":{'
+        b'"time":[1672567200,1672567500],"open":[1.1032,1.1033],"high":[1.1035,1.1036],'
+        b'"low":[1.1031,1.1032],"close":[1.1033,1.1034],"tick_volume":[1250,1300]}}\n'
+    )
+
+def test_candles_empty(worker):
+    """バーがない場合は空の列を返すことをテストする"""
+    out = serve(worker, request("candles", symbol="EMPTY", timeframe="H1"))
+    assert json.loads(out)["result"] == {k: [] for k in worker.CANDLE_FIELDS}
+
+def test_dumpb(worker):
+    """_dumpb が区切りの空白を含まない bytes を返すことをテストする"""
+    assert worker._dumpb({"a": [1, 2], "b": None}) == b'{"a":[1,2],"b":null}'
+
+def test_decode_error(worker):
+    """JSON として読めない行はエラー応答を返して処理を続けることをテストする"""
+    out = serve(worker, b"not json\n" + request("symbol_select", symbol="EURUSD"))
+    first, second = out.splitlines()
+    assert json.loads(first)["success"] is False
+    assert json.loads(first)["error"].startswith("JSONデコードエラー")
+    assert json.loads(second)["success"] is True
+
+def test_flush_when_idle(worker):
+    """入力が空になったときだけフラッシュすることをテストする"""
+    # 3件が1回の read1 で届く: 最後の応答の後に1回 + 終了時に1回
+    out_stream = CountingWriter()
+    worker.serve(io.BytesIO(request("quote", symbol="EURUSD") * 3), out_stream)
+    assert len(out_stream.getvalue().splitlines()) == 3
+    assert out_stream.flushes == 2
+    # 1件ずつ届く: 応答ごとに1回 + 終了時に1回
+    line = request("quote", symbol="EURUSD")
+    out_stream = CountingWriter()
+    worker.serve(ChunkedReader(line * 3, len(line)), out_stream)
+    assert out_stream.flushes == 4
+
+def test_flush_every(worker, monkeypatch):
+    """入力が途切れなくても FLUSH_EVERY 件ごとにフラッシュすることをテストする"""
+    monkeypatch.setattr(worker, "_input_pending", lambda stream: True)
+    monkeypatch.setattr(worker, "FLUSH_EVERY", 2)
+    line = request("quote", symbol="EURUSD")
+    out_stream = CountingWriter()
+    worker.serve(ChunkedReader(line * 4, len(line)), out_stream)
+    # 2件目・4件目 + 終了時
+    assert out_stream.flushes == 3
+
+def test_lines_split_across_chunks(worker):
+    """1行が複数の read1 にまたがっても正しく分割されることをテストする"""
+    data = request("quote", symbol="EURUSD") + request("symbol_select", symbol="EURUSD")
+    out = serve(worker, data, in_stream=ChunkedReader(data, 3))
+    assert [json.loads(line)["type"] for line in out.splitlines()] == ["quote", "symbol_select"]
+
+def test_terminate_and_partial_line(worker):
+    """terminate 以降と、改行で終わらない末尾は処理しないことをテストする"""
+    data = request("quote", symbol="EURUSD") + b'{"type":"terminate"}\n' + request("quote", symbol="EURUSD")
+    assert len(serve(worker, data).splitlines()) == 1
+    assert serve(worker, request("quote", symbol="EURUSD").rstrip(b"\n")) == b""
+
+def test_named_tuples(worker):
+    """order_send/positions_get の名前付きタプルが入れ子も含めてオブジェクトになることをテストする"""
+    out = serve(worker, request("order_send", symbol="EURUSD") + request("positions_get"))
+    order, positions = (json.loads(line) for line in out.splitlines())
+    assert order["result"] == {
+        "retcode": 10009, "order": 42,
+        "request": {"action": 1, "symbol": "EURUSD", "volume": 0.1},
+    }
+    assert positions["result"] == [
+        {"ticket": 1, "symbol": "EURUSD", "volume": 0.1},
+        {"ticket": 2, "symbol": "USDJPY", "volume": 0.2},
+    ]
+
+def test_asdict_deep(worker):
+    """ujson/json 用の変換が入れ子の名前付きタプルも dict にすることをテストする"""
+    result = OrderSendResult(10009, 42, TradeRequest(1, "EURUSD", 0.1))
+    assert worker._asdict_deep(result) == {
+        "retcode": 10009, "order": 42,
+        "request": {"action": 1, "symbol": "EURUSD", "volume": 0.1},
+    }
+
+def test_candles_binary(worker):
+    """binary 指定時は各列を生バイト列 (base64) で返すことをテストする"""
+    out = serve(worker, request("candles", symbol="EURUSD", timeframe="M5", binary=True))
+    result = json.loads(out)["result"]
+    assert result["binary"] is True
+    assert list(result["columns"]) == list(worker.CANDLE_FIELDS)
+    for k in worker.CANDLE_FIELDS:
+        column = np.frombuffer(base64.b64decode(result["columns"][k]), dtype=result["dtypes"][k])
+        assert column.tolist() == CANDLE_COLUMNS[k]
+
+def test_candles_binary_empty(worker):
+    """binary 指定でバーがない場合は空の列と既定の dtype を返すことをテストする"""
+    out = serve(worker, request("candles", symbol="EMPTY", timeframe="M5", binary=True))
+    result = json.loads(out)["result"]
+    assert result["dtypes"] == worker.CANDLE_DTYPES
+    assert result["columns"] == {k: "" for k in worker.CANDLE_FIELDS}
+
+def test_socket_writer_batches(worker):
+    """ソケットへの書き込みが flush または上限到達までまとめられることをテストする"""
+    a, b = socket.socketpair()
+    try:
+        writer = worker._SocketWriter(a, limit=8)
+        b.setblocking(False)
+        writer.write(b"abc")
+        with pytest.raises(BlockingIOError):
+            b.recv(16)
+        writer.flush()
+        assert b.recv(16) == b"abc"
+        writer.write(b"0123456789")
+        assert b.recv(16) == b"0123456789"
+    finally:
+        a.close()
+        b.close()
+
+def test_response_envelopes(worker):
+    """成功・失敗の応答が事前にエンコードした先頭部分 + 結果のバイト列になることをテストする"""
+    out = serve(worker, request("quote", symbol="EURUSD") + request("symbol_select", symbol="UNKNOWN"))
+    ok, err = out.splitlines(keepends=True)
+    assert ok == b'{"type":"quote","success":true,"result":{"bid":1.1,"ask":1.2,"time":1672567200}}\n'
+    assert err == f'{{"type":"symbol_select","success":false,"error":"symbol_selectに失敗: {STUB_ERROR}"}}\n'.encode()
+    assert set(worker._OK_PREFIX) == set(worker._ERR_PREFIX) == set(worker.HANDLERS)
@@ -6,7 +6,14 @@ import argparse
 import platform
 import socket
 import io
+import base64
+import select
 import psutil
+from functools import lru_cache
+
+# 実行環境の判定は起動時に一度だけ行う
+_IS_WIN = platform.system() == "Windows"
+
 # MT5 モジュールのインポートを安全に行う
 try:
     import MetaTrader5 as mt5
@@ -15,7 +22,257 @@ except Exception as e:
     print(json.dumps({"type":"init","success":False,"error":f"MetaTrader5 import error: {e}"}), flush=True)
     sys.exit(1)
 
-def main():
+# IPC メッセージのシリアライズには利用可能な最速の JSON ライブラリを使う
+# (orjson → ujson → 標準 json の順にフォールバック)
+# 入出力はバイナリストリームで行うため、_dumpb は UTF-8 の bytes を返す
+try:
+    import orjson
+    def _default(obj):
+        # MT5 の名前付きタプル (TradePosition など) はエンコーダの中で dict に変換する
+        if hasattr(obj, "_asdict"):
+            return obj._asdict()
+        raise TypeError
+    def _dumpb(obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    _loads = orjson.loads
+    # 名前付きタプルをそのまま渡せるか（ujson/json は配列としてシリアライズしてしまう）
+    _LAZY_ASDICT = True
+except ImportError:
+    _LAZY_ASDICT = False
+    try:
+        import ujson
+        def _dumpb(obj) -> bytes:
+            return ujson.dumps(obj).encode()
+        _loads = ujson.loads
+    except ImportError:
+        # orjson/ujson と同様に区切り文字の空白を出力しない
+        def _dumpb(obj) -> bytes:
+            return json.dumps(obj, separators=(',', ':')).encode()
+        _loads = json.loads
+
+def _asdict_deep(obj):
+    """MT5 の名前付きタプルを入れ子も含めて dict に変換する（ujson/json 用）
+
+    OrderSendResult.request のように値が名前付きタプルの場合も dict にして、
+    orjson の default フックと同じ出力にする。
+    """
+    if hasattr(obj, "_asdict"):
+        return {k: _asdict_deep(v) for k, v in obj._asdict().items()}
+    return obj
+
+# candles 応答で返す列。応答は列ごとの配列（SoA）で、キーはこの順に並ぶ
+# 例: {"time": [...], "open": [...], ..., "tick_volume": [...]}
+# 行が必要な場合は呼び出し側で zip して組み立てる
+CANDLE_FIELDS = ('time', 'open', 'high', 'low', 'close', 'tick_volume')
+# params に "binary": true が指定された場合は、各列を numpy の生バイト列 (base64) で返す
+# 例: {"binary": true, "dtypes": {"time": "<i8", ...}, "columns": {"time": "<base64>", ...}}
+# 呼び出し側は np.frombuffer(base64.b64decode(columns[k]), dtype=dtypes[k]) で復元する
+CANDLE_DTYPES = {'time': '<i8', 'open': '<f8', 'high': '<f8', 'low': '<f8', 'close': '<f8', 'tick_volume': '<u8'}
+
+# 応答の書き出しはバッファにまとめ、入力が途切れたとき（または FLUSH_EVERY 件ごと）にだけフラッシュする
+OUT_BUFFER_SIZE = 65536
+FLUSH_EVERY = 64
+# ソケット IPC では応答をこのサイズまで貯めてから sendall する
+SEND_BUFFER_LIMIT = 32768
+# 入力はバイナリのままチャンク単位で読み込み、改行で分割する
+READ_CHUNK_SIZE = 65536
+
+class _SocketWriter:
+    """ソケットへの書き込みを bytearray にまとめ、flush 時に sendall で一度に送る"""
+    def __init__(self, sock: socket.socket, limit: int = SEND_BUFFER_LIMIT):
+        self._sock = sock
+        self._limit = limit
+        self._buf = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self._buf += data
+        if len(self._buf) >= self._limit:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buf:
+            self._sock.sendall(self._buf)
+            self._buf.clear()
+
+def _input_pending(stream) -> bool:
+    """次のリクエストがすでに届いているかを調べる（調べられない場合は False）"""
+    try:
+        readable, _, _ = select.select([stream], [], [], 0)
+    except (OSError, ValueError):
+        # Windows のパイプは select で監視できないため、常にフラッシュさせる
+        return False
+    return bool(readable)
+
+# Windows のウィンドウ操作用 ctypes 定義（コールバック型はモジュール読み込み時に一度だけ作る）
+if _IS_WIN:
+    import ctypes
+    from ctypes import wintypes
+    SW_HIDE = 0
+    EnumWindowsProc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
+    # 引数・戻り値の型を宣言しておき、呼び出しごとの型推測を省く
+    _user32 = ctypes.windll.user32
+    EnumWindows = _user32.EnumWindows
+    EnumWindows.argtypes = [EnumWindowsProc, wintypes.LPARAM]
+    EnumWindows.restype = wintypes.BOOL
+    GetWindowThreadProcessId = _user32.GetWindowThreadProcessId
+    GetWindowThreadProcessId.argtypes = [wintypes.HWND, wintypes.LPDWORD]
+    GetWindowThreadProcessId.restype = wintypes.DWORD
+    ShowWindow = _user32.ShowWindow
+    ShowWindow.argtypes = [wintypes.HWND, ctypes.c_int]
+    ShowWindow.restype = wintypes.BOOL
+
+def _hide_windows(pid) -> None:
+    """指定プロセスのトップレベルウィンドウを非表示にする（Windows のみ）"""
+    # PID の受け取り用バッファは列挙全体で使い回す
+    pid_buf = wintypes.DWORD()
+    pid_ref = ctypes.byref(pid_buf)
+    hits = []
+    # 列挙中は一致したウィンドウハンドルを集めるだけにする
+    def _collect(hwnd, lParam):
+        GetWindowThreadProcessId(hwnd, pid_ref)
+        if pid_buf.value == pid:
+            hits.append(hwnd)
+        return True
+    EnumWindows(EnumWindowsProc(_collect), 0)
+    # 列挙が終わってから該当ウィンドウだけを隠す
+    for hwnd in hits:
+        ShowWindow(hwnd, SW_HIDE)
+
+# タイムフレーム名 ("M5" など) → MT5 の TIMEFRAME_* 定数。初期化後に一度だけ構築する
+_TF_MAP = {}
+
+def _build_timeframe_map() -> None:
+    prefix = "TIMEFRAME_"
+    _TF_MAP.update({
+        name[len(prefix):]: getattr(mt5, name)
+        for name in dir(mt5) if name.startswith(prefix)
+    })
+
+@lru_cache(maxsize=32)
+def _timeframe(timeframe: str):
+    """タイムフレーム名を MT5 の定数に変換する（取りうる値は少ないので結果をキャッシュする）"""
+    tf = _TF_MAP.get(timeframe.upper())
+    if tf is None:
+        raise ValueError(f"不明なタイムフレーム: {timeframe}")
+    return tf
+
+def _find_terminal_pid(terminal_exe: str):
+    """MT5 terminal64.exe のプロセスIDを探す
+
+    mt5.initialize() が起動した terminal はこのプロセスの子なので、まず子プロセスだけを調べる。
+    既に起動済みの terminal に接続した場合に備え、見つからなければ全プロセスを走査する。
+    """
+    target = os.path.normcase(terminal_exe)
+    def _matches(p) -> bool:
+        try:
+            exe_path = p.exe()
+        except (psutil.Error, OSError):
+            return False
+        return bool(exe_path) and os.path.normcase(exe_path) == target
+    try:
+        for child in psutil.Process().children(recursive=True):
+            if _matches(child):
+                return child.pid
+    except psutil.Error:
+        pass
+    for p in psutil.process_iter(['exe', 'pid']):
+        exe_path = p.info.get('exe')
+        if exe_path and os.path.normcase(exe_path) == target:
+            return p.info['pid']
+    return None
+
+class _Columns(dict):
+    """列ごとにシリアライズして書き出す結果（candles 用）
+
+    値は numpy の列またはリスト。応答全体の文字列を作らず、1列ずつ変換して書き出す。
+    """
+
+def _write_columns(out_stream, cmd_type, columns: _Columns) -> None:
+    """_Columns の結果を成功応答として1列ずつ書き出す"""
+    out_stream.write(_OK_PREFIX[cmd_type] + b"{")
+    for i, (key, col) in enumerate(columns.items()):
+        if i:
+            out_stream.write(b",")
+        values = col.tolist() if hasattr(col, "tolist") else col
+        out_stream.write(_dumpb(key) + b":" + _dumpb(values))
+    out_stream.write(b"}}\n")
+
+# ---- コマンドハンドラ ----
+# 各ハンドラは params を受け取り、(成功したか, 結果 または エラーメッセージ) を返す
+# mt5 の関数はデフォルト引数で束縛し、呼び出しごとのモジュール属性の参照を省く
+
+def _binary_columns(rates) -> dict:
+    """candles の各列を生バイト列 (base64) に変換する"""
+    if rates is None or len(rates) == 0:
+        return {
+            "binary": True,
+            "dtypes": dict(CANDLE_DTYPES),
+            "columns": {k: "" for k in CANDLE_FIELDS},
+        }
+    return {
+        "binary": True,
+        "dtypes": {k: rates.dtype[k].str for k in CANDLE_FIELDS},
+        "columns": {k: base64.b64encode(rates[k].tobytes()).decode("ascii") for k in CANDLE_FIELDS},
+    }
+
+def _cmd_candles(params, _copy_rates_from=mt5.copy_rates_from, _copy_rates_from_pos=mt5.copy_rates_from_pos):
+    symbol = params.get("symbol")
+    timeframe = params.get("timeframe")
+    tf = _timeframe(timeframe) if timeframe else None
+    count = params.get("count", 100)
+    start_time = params.get("start_time")
+    if start_time:
+        rates = _copy_rates_from(symbol, tf, start_time, count)
+    else:
+        rates = _copy_rates_from_pos(symbol, tf, 0, count)
+    if params.get("binary"):
+        return True, _binary_columns(rates)
+    if rates is None or len(rates) == 0:
+        return True, _Columns((k, []) for k in CANDLE_FIELDS)
+    # 行ごとの dict を作らず、列ごとに書き出す（変換は書き出し時に列単位で行う）
+    return True, _Columns((k, rates[k]) for k in CANDLE_FIELDS)
+
+def _cmd_order_send(params, _order_send=mt5.order_send, _last_error=mt5.last_error):
+    result = _order_send(**params)
+    if result is None:
+        return False, f"order_sendに失敗: {_last_error()}"
+    return True, result if _LAZY_ASDICT else _asdict_deep(result)
+
+def _cmd_quote(params, _tick=mt5.symbol_info_tick, _last_error=mt5.last_error):
+    tick = _tick(params.get("symbol"))
+    if tick is None:
+        return False, f"quoteに失敗: {_last_error()}"
+    return True, {"bid": tick.bid, "ask": tick.ask, "time": tick.time}
+
+def _cmd_positions_get(params, _positions_get=mt5.positions_get):
+    result = _positions_get(**params)
+    if not result:
+        return True, []
+    return True, result if _LAZY_ASDICT else [_asdict_deep(pos) for pos in result]
+
+def _cmd_symbol_select(params, _symbol_select=mt5.symbol_select, _last_error=mt5.last_error):
+    symbol = params.get("symbol")
+    enable = params.get("enable", True)
+    if _symbol_select(symbol, enable):
+        return True, None
+    return False, f"symbol_selectに失敗: {_last_error()}"
+
+# コマンド名 → ハンドラ
+HANDLERS = {
+    "candles": _cmd_candles,
+    "order_send": _cmd_order_send,
+    "quote": _cmd_quote,
+    "positions_get": _cmd_positions_get,
+    "symbol_select": _cmd_symbol_select,
+}
+
+# コマンドごとの応答の先頭部分を事前にエンコードしておく
+# 応答は {"type": ..., "success": ..., "result" または "error": ...} の順
+_OK_PREFIX = {c: b'{"type":' + _dumpb(c) + b',"success":true,"result":' for c in HANDLERS}
+_ERR_PREFIX = {c: b'{"type":' + _dumpb(c) + b',"success":false,"error":' for c in HANDLERS}
+
+def setup():
+    """引数解析・MT5 初期化・ウィンドウ非表示を行い、初期化通知を送った入出力ストリームを返す"""
     parser = argparse.ArgumentParser()
     parser.add_argument("--id", required=True)
     parser.add_argument("--login", type=int, required=True)
@@ -27,7 +284,7 @@ def main():
     args = parser.parse_args()
 
     # macOS/Linux では WINEPREFIX をセッション固有ディレクトリに設定
-    if platform.system() != 'Windows':
+    if not _IS_WIN:
         os.environ['WINEPREFIX'] = args.data_dir
         os.environ['WINEARCH'] = 'win64'
 
@@ -44,63 +301,62 @@ def main():
         # 初期化失敗を親プロセスへ通知（フラッシュ付き）
         print(json.dumps({"type":"init","success":False,"error":err}), flush=True)
         sys.exit(1)
+    _build_timeframe_map()
     # 初期化成功を親プロセスへ通知 (MT5 terminal64.exe の PID を含む)
     # MT5 terminal64.exe のプロセスIDを探す
     mt5_pid = None
-    if platform.system() == "Windows":
-        for p in psutil.process_iter(['exe', 'pid']):
-            exe_path = p.info.get('exe')
-            if exe_path and os.path.normcase(exe_path) == os.path.normcase(terminal_exe):
-                mt5_pid = p.info['pid']
-                break
-    init_msg = {"type":"init","success":True,"error":None,"mt5_pid": mt5_pid}
-    # Windows環境でMetaTraderのウィンドウを非表示化
-    if platform.system() == "Windows":
+    if _IS_WIN:
+        mt5_pid = _find_terminal_pid(terminal_exe)
+        # Windows環境でMetaTraderのウィンドウを非表示化
         try:
             # 初期化時に取得した MT5 プロセスIDを使用
-            pid = mt5_pid
-            import ctypes
-            # 定数・API定義
-            SW_HIDE = 0
-            EnumWindows = ctypes.windll.user32.EnumWindows
-            EnumWindowsProc = ctypes.WINFUNCTYPE(ctypes.c_bool, ctypes.c_int, ctypes.c_int)
-            GetWindowThreadProcessId = ctypes.windll.user32.GetWindowThreadProcessId
-            ShowWindow = ctypes.windll.user32.ShowWindow
-            # コールバックでウィンドウハンドルを隠す
-            def _hide(hwnd, lParam):
-                pid_buf = ctypes.c_ulong()
-                GetWindowThreadProcessId(hwnd, ctypes.byref(pid_buf))
-                if pid_buf.value == pid:
-                    ShowWindow(hwnd, SW_HIDE)
-                return True
-            EnumWindows(EnumWindowsProc(_hide), 0)
+            _hide_windows(mt5_pid)
         except Exception:
             pass
+    init_msg = {"type":"init","success":True,"error":None,"mt5_pid": mt5_pid}
     if args.ipc_port:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect(("127.0.0.1", args.ipc_port))
-        in_stream = sock.makefile('r', encoding='utf-8')
-        out_stream = sock.makefile('w', encoding='utf-8')
-        out_stream.write(json.dumps(init_msg) + "\n")
-        out_stream.flush()
+        in_stream = sock.makefile('rb')
+        out_stream = _SocketWriter(sock)
     else:
-        sys.stdout.write(json.dumps(init_msg) + "\n")
-        sys.stdout.flush()
-    # 入出力ストリームの選択
-    if not args.ipc_port:
-        in_stream = sys.stdin
-        out_stream = sys.stdout
+        # 入出力ストリームの選択（テキスト層を通さずバイナリで読み書きする）
+        in_stream = sys.stdin.buffer
+        out_stream = open(sys.stdout.fileno(), 'wb', buffering=OUT_BUFFER_SIZE, closefd=False)
+    out_stream.write(_dumpb(init_msg) + b"\n")
+    out_stream.flush()
+    return in_stream, out_stream
+
+def serve(in_stream, out_stream) -> None:
+    """terminate を受け取るか入力が終わるまでリクエストを処理する
+
+    ホットループだけを小さな関数にまとめ、よく使う名前はローカル変数で参照する。
+    """
+    read1 = in_stream.read1
+    write = out_stream.write
+    loads = _loads
+    dumpb = _dumpb
+    get_handler = HANDLERS.get
+    pending = 0  # フラッシュ待ちの応答数
+    buf = bytearray()  # 未処理の受信データ
 
     while True:
         try:
-            line = in_stream.readline()
-            if not line:  # EOF
-                break
+            i = buf.find(b"\n")
+            if i < 0:
+                chunk = read1(READ_CHUNK_SIZE)
+                if not chunk:  # EOF
+                    break
+                buf += chunk
+                continue
+            line = bytes(buf[:i])
+            del buf[:i + 1]
                 
             try:
-                req = json.loads(line)
-            except json.JSONDecodeError as e:
-                out_stream.write(json.dumps({"success": False, "error": f"JSONデコードエラー: {str(e)}"}) + "\n")
+                req = loads(line)
+            except ValueError as e:
+                # orjson/ujson/json いずれのデコードエラーも ValueError のサブクラス
+                write(dumpb({"success": False, "error": f"JSONデコードエラー: {str(e)}"}) + b"\n")
                 out_stream.flush()
                 continue
                 
@@ -109,73 +365,33 @@ def main():
                 
             cmd_type = req.get("type")
             params = req.get("params", {})
-            res = {"type": cmd_type}
-            
-            try:
-                if cmd_type == "candles":
-                    symbol = params.get("symbol")
-                    timeframe = params.get("timeframe")
-                    tf = getattr(mt5, "TIMEFRAME_" + timeframe.upper()) if timeframe else None
-                    count = params.get("count", 100)
-                    start_time = params.get("start_time")
-                    if start_time:
-                        rates = mt5.copy_rates_from(symbol, tf, start_time, count)
-                    else:
-                        rates = mt5.copy_rates_from_pos(symbol, tf, 0, count)
-                    if rates is None or len(rates) == 0:
-                        result_list = []
-                    else:
-                        result_list = [
-                            {
-                                "time": int(r['time']) if hasattr(r['time'], 'item') else r['time'],
-                                "open": float(r['open']),
-                                "high": float(r['high']),
-                                "low": float(r['low']),
-                                "close": float(r['close']),
-                                "tick_volume": int(r['tick_volume']) if hasattr(r['tick_volume'], 'item') else r['tick_volume']
-                            }
-                            for r in rates
-                        ]
-                    res.update({"success": True, "result": result_list})
-                elif cmd_type == "order_send":
-                    result = mt5.order_send(**params)
-                    if result is None:
-                        error = mt5.last_error()
-                        res.update({"success": False, "error": f"order_sendに失敗: {error}"})
-                    else:
-                        res.update({"success": True, "result": result._asdict()})
-                elif cmd_type == "quote":
-                    tick = mt5.symbol_info_tick(params.get("symbol"))
-                    if tick is None:
-                        error = mt5.last_error()
-                        res.update({"success": False, "error": f"quoteに失敗: {error}"})
-                    else:
-                        res.update({"success": True, "result": {"bid": tick.bid, "ask": tick.ask, "time": tick.time}})
-                elif cmd_type == "positions_get":
-                    result = mt5.positions_get(**params)
-                    positions_list = [pos._asdict() for pos in result] if result else []
-                    res.update({"success": True, "result": positions_list})
-                elif cmd_type == "symbol_select":
-                    symbol = params.get("symbol")
-                    enable = params.get("enable", True)
-                    ok = mt5.symbol_select(symbol, enable)
-                    if ok:
-                        res.update({"success": True, "result": None})
-                    else:
-                        error = mt5.last_error()
-                        res.update({"success": False, "error": f"symbol_selectに失敗: {error}"})
+            handler = get_handler(cmd_type)
+            if handler is None:
+                res = {"type": cmd_type, "success": False, "error": f"不明なコマンド: {cmd_type}"}
+                write(dumpb(res) + b"\n")
+            else:
+                try:
+                    ok, value = handler(params)
+                except Exception as e:
+                    ok, value = False, str(e)
+                # 既知のコマンドは事前にエンコードした先頭部分に結果だけを続ける
+                if not ok:
+                    write(_ERR_PREFIX[cmd_type] + dumpb(value) + b"}\n")
+                elif isinstance(value, _Columns):
+                    _write_columns(out_stream, cmd_type, value)
                 else:
-                    res.update({"success": False, "error": f"不明なコマンド: {cmd_type}"})
-            except Exception as e:
-                res.update({"success": False, "error": str(e)})
-                
-            out_stream.write(json.dumps(res) + "\n")
-            out_stream.flush()
+                    write(_OK_PREFIX[cmd_type] + dumpb(value) + b"}\n")
+            pending += 1
+            # 親プロセスは応答を待ってから次を送るので、入力が空なら必ずフラッシュする
+            if pending >= FLUSH_EVERY or (b"\n" not in buf and not _input_pending(in_stream)):
+                out_stream.flush()
+                pending = 0
         except Exception as e:
             try:
                 error_msg = {"success": False, "error": f"予期せぬエラー: {str(e)}"}
-                out_stream.write(json.dumps(error_msg) + "\n")
+                write(dumpb(error_msg) + b"\n")
                 out_stream.flush()
+                pending = 0
             except Exception as write_err:
                 try:
                     sys.stdout.write(json.dumps({"success": False, "error": f"エラーレスポンス送信に失敗: {str(write_err)}"}) + "\n")
@@ -183,6 +399,15 @@ def main():
                 except:
                     pass
 
+    # 未送信の応答を残さない
+    try:
+        out_stream.flush()
+    except Exception:
+        pass
+
+def main():
+    in_stream, out_stream = setup()
+    serve(in_stream, out_stream)
     mt5.shutdown()
     # MT5 terminal64.exe の終了は SessionManager で行います
 